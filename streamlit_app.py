@@ -1,9 +1,16 @@
 import streamlit as st
 import requests
-import pandas as pd
-from utils import format_search_results
-import yaml
-from io import StringIO
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+import json
+import uuid
+from utils import (
+    RESULTS_COLUMN_CONFIG,
+    ChunkedReader,
+    format_search_results,
+    stream_multipart_body,
+)
 
 # --- Configuration ---
 # Set the layout and title for the Streamlit page.
@@ -14,6 +21,95 @@ st.set_page_config(
 )
 
 
+@st.cache_resource
+def get_http_adapter():
+    """Returns an HTTP adapter whose connection pool is shared across reruns.
+
+    Connection errors are retried for every method; a failed connection sends
+    no body, so streamed uploads are not resent. Read timeouts aren't retried so
+    a slow backend can't hold a request open for several times its timeout.
+    """
+    return HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=2, read=0, backoff_factor=0.2),
+    )
+
+
+# Streamlit re-executes this script on every rerun and shares cached resources
+# between users, so only the adapter (and its keep-alive connections) is cached.
+# Each run gets its own session so cookies are never shared between users.
+SESSION = requests.Session()
+SESSION.mount("http://", get_http_adapter())
+SESSION.mount("https://", get_http_adapter())
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def probe_api_status(api_base_url):
+    """Returns the status code of the API's /status endpoint, or None if unreachable.
+
+    Cached briefly so the sidebar doesn't issue a request on every rerun.
+    """
+    try:
+        response = SESSION.get(f"{api_base_url}/status", timeout=5)
+        return response.status_code
+    except requests.exceptions.RequestException:
+        return None
+
+
+def metadata_form_inputs(key_prefix, experiment_placeholder):
+    """Renders the metadata inputs shared by the upload forms and returns them."""
+    research_project_id = st.text_input(
+        "Research Project ID*",
+        placeholder="e.g., BBBO",
+        key=f"{key_prefix}_proj",
+    )
+    author = st.text_input(
+        "Author*", placeholder="e.g., wkm2109", key=f"{key_prefix}_author"
+    )
+    experiment_type = st.text_input(
+        "Experiment Type",
+        placeholder=experiment_placeholder,
+        key=f"{key_prefix}_exp",
+    )
+    date_conducted = st.date_input("Date Conducted", key=f"{key_prefix}_date")
+    custom_tags = st.text_input(
+        "Custom Tags (comma-separated)",
+        placeholder="e.g., tag1, important_data",
+        key=f"{key_prefix}_tags",
+    )
+    return {
+        "research_project_id": research_project_id,
+        "author": author,
+        "experiment_type": experiment_type,
+        "date_conducted": date_conducted.isoformat() if date_conducted else None,
+        "custom_tags": custom_tags,
+    }
+
+
+def serialize_metadata(metadata_dict):
+    """Serializes upload metadata for the API's metadata.yaml form part.
+
+    Uses JSON so PyYAML's slow emitter is skipped; the backend's YAML parser
+    reads it as-is. Non-ASCII characters are written literally because PyYAML
+    does not rejoin the surrogate-pair escapes `json.dumps` emits by default.
+    """
+    return json.dumps(metadata_dict, ensure_ascii=False)
+
+
+def show_upload_response(response, success_message):
+    """Displays the outcome of an upload request."""
+    if response.status_code == 200:
+        st.success(success_message)
+        st.json(response.json())
+    else:
+        st.error(f"Upload failed. Status code: {response.status_code}")
+        try:
+            st.json(response.json())
+        except requests.exceptions.JSONDecodeError:
+            st.text(response.text)
+
+
 def show_upload_page(api_base_url):
     """Renders the upload page UI and logic."""
     st.header("Upload Data")
@@ -33,70 +129,50 @@ def show_upload_page(api_base_url):
         if data_file is not None:
             with st.form(key="single_file_metadata_form"):
                 st.subheader(f"Metadata for: `{data_file.name}`")
-                research_project_id = st.text_input(
-                    "Research Project ID*",
-                    placeholder="e.g., BBBO",
-                    key="single_proj",
-                )
-                author = st.text_input(
-                    "Author*", placeholder="e.g., wkm2109", key="single_author"
-                )
-                experiment_type = st.text_input(
-                    "Experiment Type",
-                    placeholder="e.g., Frequency_Sweep",
-                    key="single_exp",
-                )
-                date_conducted = st.date_input("Date Conducted", key="single_date")
-                custom_tags = st.text_input(
-                    "Custom Tags (comma-separated)",
-                    placeholder="e.g., tag1, important_data",
-                    key="single_tags",
+                metadata_dict = metadata_form_inputs(
+                    "single", experiment_placeholder="e.g., Frequency_Sweep"
                 )
                 submit_button = st.form_submit_button(label="Upload File and Metadata")
 
                 if submit_button:
-                    if not research_project_id or not author:
+                    if (
+                        not metadata_dict["research_project_id"]
+                        or not metadata_dict["author"]
+                    ):
                         st.error("Please fill in all required fields (*).")
                         return
 
-                    metadata_dict = {
-                        "research_project_id": research_project_id,
-                        "author": author,
-                        "experiment_type": experiment_type,
-                        "date_conducted": date_conducted.isoformat()
-                        if date_conducted
-                        else None,
-                        "custom_tags": custom_tags,
-                    }
-                    yaml_string = yaml.dump(metadata_dict, sort_keys=False)
-                    metadata_file_obj = StringIO(yaml_string)
-                    metadata_file_obj.name = "metadata.yaml"
-
-                    files = {
-                        "data_file": (data_file.name, data_file, data_file.type),
-                        "metadata_file": (
-                            metadata_file_obj.name,
-                            metadata_file_obj.getvalue(),
-                            "text/yaml",
-                        ),
-                    }
+                    metadata_json = serialize_metadata(metadata_dict)
+
+                    # Wrap the upload so the encoder reads it in chunks rather
+                    # than copying the whole buffer before sending.
+                    # ChunkedReader reads from the current position, so rewind
+                    # in case the buffer was read earlier in this run.
+                    data_file.seek(0)
+                    encoder = MultipartEncoder(
+                        fields={
+                            "data_file": (
+                                data_file.name,
+                                ChunkedReader(data_file),
+                                data_file.type or "application/octet-stream",
+                            ),
+                            "metadata_file": (
+                                "metadata.yaml",
+                                metadata_json,
+                                "text/yaml",
+                            ),
+                        }
+                    )
 
                     try:
                         with st.spinner(f"Uploading `{data_file.name}`..."):
-                            response = requests.post(
-                                f"{api_base_url}/uploadfile/", files=files, timeout=7200
-                            )
-                        if response.status_code == 200:
-                            st.success("File processed successfully!")
-                            st.json(response.json())
-                        else:
-                            st.error(
-                                f"Upload failed. Status code: {response.status_code}"
+                            response = SESSION.post(
+                                f"{api_base_url}/uploadfile/",
+                                data=encoder,
+                                headers={"Content-Type": encoder.content_type},
+                                timeout=7200,
                             )
-                            try:
-                                st.json(response.json())
-                            except requests.exceptions.JSONDecodeError:
-                                st.text(response.text)
+                        show_upload_response(response, "File processed successfully!")
                     except requests.exceptions.RequestException as e:
                         st.error(f"An error occurred during upload: {e}")
 
@@ -113,80 +189,80 @@ def show_upload_page(api_base_url):
         if zip_file is not None:
             with st.form(key="folder_metadata_form"):
                 st.subheader(f"Metadata for all files in: `{zip_file.name}`")
-                research_project_id = st.text_input(
-                    "Research Project ID*",
-                    placeholder="e.g., BBBO",
-                    key="folder_proj",
-                )
-                author = st.text_input(
-                    "Author*", placeholder="e.g., wkm2109", key="folder_author"
-                )
-                experiment_type = st.text_input(
-                    "Experiment Type",
-                    placeholder="e.g., Frequency Sweep",
-                    key="folder_exp",
-                )
-                date_conducted = st.date_input("Date Conducted", key="folder_date")
-                custom_tags = st.text_input(
-                    "Custom Tags (comma-separated)",
-                    placeholder="e.g., tag1, important_data",
-                    key="folder_tags",
+                metadata_dict = metadata_form_inputs(
+                    "folder", experiment_placeholder="e.g., Frequency Sweep"
                 )
                 submit_button = st.form_submit_button(
                     label="🚀 Upload Folder and Metadata"
                 )
 
                 if submit_button:
-                    if not research_project_id or not author:
+                    if (
+                        not metadata_dict["research_project_id"]
+                        or not metadata_dict["author"]
+                    ):
                         st.error("Please fill in all required fields (*).")
                         return
 
-                    metadata_dict = {
-                        "research_project_id": research_project_id,
-                        "author": author,
-                        "experiment_type": experiment_type,
-                        "date_conducted": date_conducted.isoformat()
-                        if date_conducted
-                        else None,
-                        "custom_tags": custom_tags,
-                    }
-                    yaml_string = yaml.dump(metadata_dict, sort_keys=False)
-                    metadata_file_obj = StringIO(yaml_string)
-                    metadata_file_obj.name = "metadata.yaml"
-
-                    files = {
-                        "zip_file": (zip_file.name, zip_file, "application/zip"),
-                        "metadata_file": (
-                            metadata_file_obj.name,
-                            metadata_file_obj.getvalue(),
-                            "text/yaml",
-                        ),
-                    }
+                    metadata_json = serialize_metadata(metadata_dict)
+
+                    # Passing a generator makes `requests` use chunked transfer
+                    # encoding, so the archive is streamed in fixed-size slices.
+                    zip_file.seek(0)
+                    boundary = uuid.uuid4().hex
+                    body = stream_multipart_body(
+                        boundary,
+                        {
+                            "zip_file": (zip_file.name, zip_file, "application/zip"),
+                            "metadata_file": (
+                                "metadata.yaml",
+                                metadata_json,
+                                "text/yaml",
+                            ),
+                        },
+                    )
 
                     try:
                         with st.spinner(
                             f"Uploading and processing `{zip_file.name}`... This may take a while."
                         ):
-                            response = requests.post(
+                            response = SESSION.post(
                                 f"{api_base_url}/upload_folder/",
-                                files=files,
+                                data=body,
+                                headers={
+                                    "Content-Type": f"multipart/form-data; boundary={boundary}"
+                                },
                                 timeout=7200,  # 2 hours for very large folders
                             )
-                        if response.status_code == 200:
-                            st.success("Folder processed successfully!")
-                            st.json(response.json())
-                        else:
-                            st.error(
-                                f"Upload failed. Status code: {response.status_code}"
-                            )
-                            try:
-                                st.json(response.json())
-                            except requests.exceptions.JSONDecodeError:
-                                st.text(response.text)
+                        show_upload_response(response, "Folder processed successfully!")
                     except requests.exceptions.RequestException as e:
                         st.error(f"An error occurred during upload: {e}")
 
 
+def set_search_results(results):
+    """Stores formatted search results and their lookups in session state.
+
+    Done once per search so reruns triggered by the download widgets reuse the
+    formatted DataFrame instead of rebuilding and filtering it.
+    """
+    if results:
+        results_df = format_search_results(results)
+        st.session_state.results_df = results_df
+        # Rows without a file ID (NA under the string dtype) can't be downloaded
+        st.session_state.name_to_ids = (
+            results_df.dropna(subset=["file_id"])
+            .groupby("file_name", sort=False)["file_id"]
+            .apply(list)
+            .to_dict()
+        )
+        # The index keys are already unique and in first-seen order
+        st.session_state.filenames = list(st.session_state.name_to_ids)
+    else:
+        st.session_state.results_df = None
+        st.session_state.filenames = []
+        st.session_state.name_to_ids = {}
+
+
 # --- UI Sections ---
 def show_search_page(api_base_url):
     """Renders the search page UI and logic."""
@@ -236,7 +312,7 @@ def show_search_page(api_base_url):
 
         try:
             with st.spinner("Searching..."):
-                response = requests.get(
+                response = SESSION.get(
                     f"{api_base_url}/search", params=params, timeout=60
                 )
 
@@ -245,80 +321,70 @@ def show_search_page(api_base_url):
                 if results:
                     st.success(f"Found {len(results)} matching files.")
                     # Store results in session state to persist them
-                    st.session_state.search_results = results
+                    set_search_results(results)
                 else:
                     st.info("No files found matching your criteria.")
-                    st.session_state.search_results = []  # Clear previous results
+                    set_search_results([])  # Clear previous results
             else:
                 st.error(f"Search failed. Status code: {response.status_code}")
                 try:
                     st.json(response.json())
                 except requests.exceptions.JSONDecodeError:
                     st.text(response.text)  # Show raw text if not JSON
-                st.session_state.search_results = []
+                set_search_results([])
 
         except requests.exceptions.RequestException as e:
             st.error(f"An error occurred during search: {e}")
-            st.session_state.search_results = []
+            set_search_results([])
 
     # --- Results Display ---
     st.markdown("---")
     st.subheader("Results")
-    if "search_results" in st.session_state and st.session_state.search_results:
-        results_df = format_search_results(
-            pd.DataFrame(st.session_state.search_results)
+    if st.session_state.get("results_df") is not None:
+        st.dataframe(
+            st.session_state.results_df,
+            column_config=RESULTS_COLUMN_CONFIG,
+            use_container_width=True,
         )
-        st.dataframe(results_df, use_container_width=True)
 
         # --- Download Section ---
         st.markdown("---")
         st.subheader("Download a File: ")
 
-        # Create a list of unique filenames for the dropdown
-        filenames = results_df["file_name"].unique().tolist()
-
         selected_filename = st.selectbox(
             "Select a file from the results above to download:",
-            options=filenames,
+            options=st.session_state.filenames,
             index=None,  # Default to no selection
             placeholder="Choose a file...",
         )
 
         if selected_filename:
             # Check for duplicates
-            matching_files = results_df[results_df["file_name"] == selected_filename]
+            file_ids = st.session_state.name_to_ids[selected_filename]
 
-            if len(matching_files) > 1:
+            if len(file_ids) > 1:
                 # Handle duplicates with a second dropdown for file_id
                 st.warning(
-                    f"Found {len(matching_files)} files named '{selected_filename}'. Please select the specific File ID to download."
+                    f"Found {len(file_ids)} files named '{selected_filename}'. Please select the specific File ID to download."
                 )
 
-                # Get a list of file IDs for the dropdown
-                file_ids = matching_files["file_id"].tolist()
-
                 selected_file_id = st.selectbox(
                     "Select the exact File ID to download:",
                     options=file_ids,
                     index=None,
                     placeholder="Choose a File ID...",
                 )
-
-                if selected_file_id:
-                    download_url = f"{api_base_url}/download/{selected_file_id}"
-                    st.link_button(
-                        f"Download File ID: {selected_file_id}",
-                        url=download_url,
-                        use_container_width=True,
-                    )
+                label = f"Download File ID: {selected_file_id}"
 
             else:
                 # No duplicates, proceed as normal
-                selected_file_id = matching_files.iloc[0]["file_id"]
-                download_url = f"{api_base_url}/download/{selected_file_id}"
+                selected_file_id = file_ids[0]
+                label = f"Download '{selected_filename}'"
+
+            if selected_file_id:
                 st.link_button(
-                    f"Download '{selected_filename}'",
-                    url=download_url,
+                    label,
+                    url=f"{api_base_url}/download/{selected_file_id}",
                     use_container_width=True,
                 )
 
@@ -350,14 +416,13 @@ with st.sidebar:
         )
 
         st.subheader("API Status")
-        try:
-            response = requests.get(f"{api_base_url}/status", timeout=5)
-            if response.status_code == 200:
-                st.success("Connected")
-            else:
-                st.error(f"Status: {response.status_code}")
-        except requests.exceptions.RequestException:
+        status_code = probe_api_status(api_base_url)
+        if status_code is None:
             st.error("Connection Error")
+        elif status_code == 200:
+            st.success("Connected")
+        else:
+            st.error(f"Status: {status_code}")
 
 
 # --- Page Content ---
@@ -1,12 +1,42 @@
+import io
+
 import pandas as pd
+import streamlit as st
+
+# Dtypes for the search result columns, applied in one pass instead of relying
+# on inference. The date columns are parsed separately with explicit formats.
+RESULTS_SCHEMA = {
+    "file_name": "string",
+    "research_project_id": "string",
+    "author": "string",
+    "file_type": "string",
+    "experiment_type": "string",
+    "size_bytes": "Int64",
+    "custom_tags": "string",
+    "file_id": "string",
+    "minio_object_path": "string",
+}
+
+# Display formats for the date columns produced by `format_search_results`.
+RESULTS_COLUMN_CONFIG = {
+    "date_conducted": st.column_config.DateColumn(format="YYYY-MM-DD"),
+    "upload_timestamp": st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm:ss"),
+}
+
+# Size of each slice read from an uploaded file when streaming it to the API.
+UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Characters percent-encoded in multipart header parameters (WHATWG HTML Standard).
+MULTIPART_PARAM_ESCAPES = {ord("\n"): "%0A", ord("\r"): "%0D", ord('"'): "%22"}
 
 
-def format_search_results(df):
-    """Formats a DataFrame of search results for better display."""
-    # The error occurs when checking the truth value of a DataFrame.
-    # The correct way to check if a DataFrame is empty is to use the `.empty` attribute.
-    if df.empty:
-        return pd.DataFrame()
+def format_search_results(results):
+    """Formats a non-empty list of search results into a DataFrame for better display.
+
+    Callers check for empty results themselves so no DataFrame is built when
+    there is nothing to show.
+    """
+    df = pd.DataFrame(results)
 
     # Reorder columns for better readability
     desired_order = [
@@ -25,23 +55,81 @@ def format_search_results(df):
     # Filter out columns that don't exist in the dataframe
     existing_columns = [col for col in desired_order if col in df.columns]
 
-    # Create a copy to avoid SettingWithCopyWarning
-    df = df[existing_columns].copy()
+    # Select the columns as a new frame and build converted columns with
+    # `assign`, so nothing is modified in place on a view of the original.
+    df = df.reindex(columns=existing_columns)
+    df = df.astype({k: v for k, v in RESULTS_SCHEMA.items() if k in df.columns})
 
-    # Format dates and sizes
+    # Parse dates and sizes. The API returns ISO 8601 strings, so an explicit
+    # format keeps pandas on its vectorized parser instead of per-row inference.
+    # Dates stay as datetime64 columns; display formatting is left to
+    # RESULTS_COLUMN_CONFIG so they serialize to Arrow without string conversion.
+    converted = {}
     if "date_conducted" in df.columns:
-        df["date_conducted"] = pd.to_datetime(df["date_conducted"]).dt.strftime(
-            "%Y-%m-%d"
+        converted["date_conducted"] = pd.to_datetime(
+            df["date_conducted"], format="ISO8601", errors="coerce"
         )
     if "upload_timestamp" in df.columns:
-        df["upload_timestamp"] = pd.to_datetime(df["upload_timestamp"]).dt.strftime(
-            "%Y-%m-%d %H:%M:%S"
+        converted["upload_timestamp"] = pd.to_datetime(
+            df["upload_timestamp"], format="ISO8601", errors="coerce"
         )
-
-    # Convert size_bytes to a human-readable format
     if "size_bytes" in df.columns:
-        df["size_bytes"] = df["size_bytes"].fillna(0).astype(int)
-        # Rename column for clarity in display
-        df.rename(columns={"size_bytes": "size_in_bytes"}, inplace=True)
+        converted["size_bytes"] = df["size_bytes"].fillna(0).astype("int64")
+
+    # Rename column for clarity in display
+    df = df.assign(**converted).rename(columns={"size_bytes": "size_in_bytes"})
 
     return df
+
+
+class ChunkedReader:
+    """Read-only view of a file-like object for `MultipartEncoder`.
+
+    The encoder copies any object with a `getvalue` method (such as Streamlit's
+    BytesIO-based `UploadedFile`) into a second buffer before sending it. This
+    wrapper only exposes `read` and the number of bytes left to read, so the
+    encoder pulls the file in chunks from its current position instead.
+    """
+
+    def __init__(self, file_obj):
+        self._file_obj = file_obj
+        start = file_obj.tell()
+        self._size = file_obj.seek(0, io.SEEK_END)
+        file_obj.seek(start)
+
+    @property
+    def len(self):
+        return self._size - self._file_obj.tell()
+
+    def read(self, size=-1):
+        return self._file_obj.read(size)
+
+
+def read_in_chunks(file_obj, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Yields successive chunks read from a file-like object."""
+    while chunk := file_obj.read(chunk_size):
+        yield chunk
+
+
+def stream_multipart_body(boundary, fields):
+    """Yields a multipart/form-data body part by part.
+
+    `fields` maps form field names to `(filename, content, content_type)`
+    tuples, where `content` is either a string or a file-like object. File-like
+    contents are read in chunks so the full body is never held in memory.
+    """
+    for name, (filename, content, content_type) in fields.items():
+        # Percent-encode quotes and line breaks as browsers and urllib3 do, so a
+        # crafted filename can't close the parameter or inject header lines.
+        filename = filename.translate(MULTIPART_PARAM_ESCAPES)
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode()
+        if isinstance(content, str):
+            yield content.encode()
+        else:
+            yield from read_in_chunks(content)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()